@@ -1,27 +1,86 @@
 # app.py
 # Full Flask app: file uploads + Google Sheets (Service Account) integration
 import os
-import json
+import io
+import glob
+import time
+import shutil
 import tempfile
+import threading
 import traceback
-from flask import Flask, render_template, request, send_file, abort, redirect, url_for
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time as dt_time, timezone
+from functools import lru_cache
+from flask import Flask, Request, render_template, request, send_file, abort, redirect, url_for
+import orjson
 import pandas as pd
+import requests
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+import google.auth.transport.requests
+import google_auth_httplib2
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import build_http
+from googleapiclient.model import JsonModel
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 
 # Your quote generator (must exist in project)
-from quote_generator import make_term_quote_from_excel
+from quote_generator import make_term_quote, read_sheets
 
 # ---------- Flask / config ----------
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+
+class UploadRequest(Request):
+    """Spool multipart uploads in memory up to 1 MiB, then to a temp file on disk."""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_CHUNK_SIZE, mode="rb+")
+
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.secret_key = os.environ.get("FLASK_SECRET", "insecure-dev-secret")
-UPLOAD_FOLDER = os.path.join(os.getcwd(), "uploads")
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("MAX_UPLOAD_MB", "32")) * 1024 * 1024
+
+def _sweep_stale_temp_files(max_age=3600):
+    """Remove intermediate/output files left in the temp dir by earlier runs."""
+    tmpdir = tempfile.gettempdir()
+    cutoff = time.time() - max_age
+    for pattern in ("combined_*.xlsx", "*_term_quote_final.docx"):
+        for path in glob.glob(os.path.join(tmpdir, pattern)):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.unlink(path)
+            except OSError:
+                pass
+
+_sweep_stale_temp_files()
+
+DOCX_MIMETYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+def send_docx(buf, download_name, **kwargs):
+    """send_file() an in-memory DOCX as an attachment."""
+    return send_file(buf, as_attachment=True, download_name=download_name,
+                     mimetype=DOCX_MIMETYPE, **kwargs)
 
 # ---------- Google Sheets API helpers ----------
-SCOPES = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets.readonly",
+    # needed for the docs.google.com XLSX export
+    "https://www.googleapis.com/auth/drive.readonly",
+]
 
+# Pooled keep-alive session for direct XLSX exports
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=10,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 503]),
+))
+
+@lru_cache(maxsize=1)
 def get_service_account_creds():
     """
     Create Credentials either from:
@@ -37,53 +96,251 @@ def get_service_account_creds():
     # 2) Otherwise try GOOGLE_SA_JSON (the JSON content stored as a secret)
     sa_json = os.environ.get("GOOGLE_SA_JSON")
     if sa_json:
-        info = json.loads(sa_json)
+        info = orjson.loads(sa_json)
         creds = service_account.Credentials.from_service_account_info(info, scopes=SCOPES)
         return creds
 
     raise RuntimeError("No Google service account credentials found. Set GOOGLE_APPLICATION_CREDENTIALS or GOOGLE_SA_JSON.")
 
+class OrjsonModel(JsonModel):
+    """JsonModel that decodes API responses with orjson instead of stdlib json."""
+    def deserialize(self, content):
+        try:
+            body = orjson.loads(content)
+        except orjson.JSONDecodeError:
+            return content.decode("utf-8") if isinstance(content, bytes) else content
+        if self._data_wrapper and "data" in body:
+            body = body["data"]
+        return body
+
+_SHEETS_SERVICE = None
+
+def get_sheets_service():
+    """
+    Return a process-wide Sheets API service, built on first use.
+    The Credentials object refreshes its own token, so the service stays valid.
+    """
+    global _SHEETS_SERVICE
+    if _SHEETS_SERVICE is None:
+        _SHEETS_SERVICE = build('sheets', 'v4', credentials=get_service_account_creds(),
+                                cache_discovery=False, static_discovery=True,
+                                model=OrjsonModel())
+    return _SHEETS_SERVICE
+
+_HTTP_LOCAL = threading.local()
+
+def _authorized_http():
+    """
+    httplib2.Http is not thread-safe, so requests built from the shared service
+    are executed on a per-thread authorised Http instead of the service's own.
+    build_http() gives it the same socket timeout and redirect handling build() uses.
+    """
+    http = getattr(_HTTP_LOCAL, "http", None)
+    if http is None:
+        http = _HTTP_LOCAL.http = google_auth_httplib2.AuthorizedHttp(
+            get_service_account_creds(), http=build_http())
+    return http
+
+RETRYABLE_STATUSES = (429, 500, 503)
+_backoff = wait_exponential_jitter(initial=1, max=30)
+
+def _is_retryable(exc: BaseException) -> bool:
+    """Only throttling / transient server errors are worth retrying."""
+    return isinstance(exc, HttpError) and exc.resp.status in RETRYABLE_STATUSES
+
+def _wait_retry_after_or_backoff(retry_state) -> float:
+    """Honor a Retry-After header when Google sends one, else back off exponentially."""
+    exc = retry_state.outcome.exception()
+    retry_after = exc.resp.get("retry-after") if isinstance(exc, HttpError) else None
+    if retry_after:
+        try:
+            return min(float(retry_after), 30)
+        except ValueError:
+            pass
+    return _backoff(retry_state)
+
+# At most 5 Sheets calls in flight and >= 100 ms between calls (<= 10 QPS per process)
+SHEETS_MAX_CONCURRENCY = 5
+SHEETS_MIN_INTERVAL = 0.1
+_SHEETS_SEM = threading.BoundedSemaphore(SHEETS_MAX_CONCURRENCY)
+_LAST_CALL = [0.0]
+_LAST_CALL_LOCK = threading.Lock()
+
+def _throttled_execute(request):
+    """Run request.execute() under the concurrency cap and minimum call spacing."""
+    with _SHEETS_SEM:
+        with _LAST_CALL_LOCK:
+            wait = max(0.0, SHEETS_MIN_INTERVAL - (time.monotonic() - _LAST_CALL[0]))
+            time.sleep(wait)
+            _LAST_CALL[0] = time.monotonic()
+        return request.execute(http=_authorized_http())
+
+@retry(retry=retry_if_exception(_is_retryable), wait=_wait_retry_after_or_backoff,
+       stop=stop_after_attempt(5), reraise=True)
+def _execute(request):
+    """Execute a googleapiclient request, retrying 429/500/503 responses."""
+    return _throttled_execute(request)
+
+# Explicit bounds so the API doesn't scan the whole grid; well past the
+# handful of columns/rows the quote sheets use.
+SHEET_LAST_COLUMN = "AZ"
+SHEET_MAX_ROWS = 10000
+_VALUE_OPTIONS = dict(
+    valueRenderOption="UNFORMATTED_VALUE",
+    # keep dates (e.g. DOB) readable instead of serial numbers
+    dateTimeRenderOption="FORMATTED_STRING",
+    majorDimension="ROWS",
+)
+
+def _a1_range(sheet_name: str) -> str:
+    """Bounded A1 range for a whole tab, quoting the name (it may contain spaces)."""
+    quoted = sheet_name.replace("'", "''")
+    return f"'{quoted}'!A1:{SHEET_LAST_COLUMN}{SHEET_MAX_ROWS}"
+
+def _values_to_df(values: list) -> pd.DataFrame:
+    """
+    First row is the header. Cells are kept as-is in object columns: they are
+    only ever stringified downstream, so per-column dtype inference is wasted.
+    The API trims trailing blank cells, so every data row is padded with None
+    to the header width; cells beyond the last header have no column name and
+    are dropped.
+    """
+    if not values:
+        return pd.DataFrame()
+    header = values[0]
+    n = len(header)
+    rows = [(r + [None] * (n - len(r)))[:n] for r in values[1:]]
+    return pd.DataFrame(rows, columns=header, dtype=object)
+
 def read_sheet_to_df(spreadsheet_id: str, sheet_name: str) -> pd.DataFrame:
     """Read a sheet by name into a pandas DataFrame using Sheets API."""
-    creds = get_service_account_creds()
-    service = build('sheets', 'v4', credentials=creds, cache_discovery=False)
-    sheet = service.spreadsheets()
+    sheet = get_sheets_service().spreadsheets()
     try:
-        resp = sheet.values().get(spreadsheetId=spreadsheet_id, range=sheet_name).execute()
+        resp = _execute(sheet.values().get(spreadsheetId=spreadsheet_id, range=_a1_range(sheet_name),
+                                           **_VALUE_OPTIONS))
     except Exception as e:
         # bubble up helpful message
-        raise RuntimeError(f"Error reading sheet '{sheet_name}' from {spreadsheet_id}: {e}")
-    values = resp.get('values', [])
-    if not values:
-        return pd.DataFrame()
-    df = pd.DataFrame(values[1:], columns=values[0])
-    return df
+        raise RuntimeError(f"Error reading sheet '{sheet_name}' from {spreadsheet_id}: {e}") from e
+    return _values_to_df(resp.get('values', []))
+
+def read_sheets_batch(spreadsheet_id: str, sheet_names: list) -> dict:
+    """
+    Read several sheets in one round-trip using values.batchGet.
+    Returns {sheet_name: DataFrame} in the order requested.
+    """
+    sheet = get_sheets_service().spreadsheets()
+    try:
+        resp = _execute(sheet.values().batchGet(
+            spreadsheetId=spreadsheet_id,
+            ranges=[_a1_range(name) for name in sheet_names],
+            **_VALUE_OPTIONS,
+        ))
+    except Exception as e:
+        raise RuntimeError(f"Error reading sheets {sheet_names} from {spreadsheet_id}: {e}") from e
+    sheets = {}
+    for name, value_range in zip(sheet_names, resp.get('valueRanges', [])):
+        sheets[name] = _values_to_df(value_range.get('values', []))
+    return sheets
+
+def _is_bad_range(exc: Exception) -> bool:
+    """
+    True if a read failed because the range names a tab that doesn't exist
+    (HTTP 400 "Unable to parse range"). Other 400s, e.g. FAILED_PRECONDITION
+    for an uploaded .xlsx in Drive, are real errors and must not match.
+    """
+    cause = exc.__cause__
+    if not (isinstance(cause, HttpError) and cause.resp.status == 400):
+        return False
+    detail = f"{cause.reason} {cause.content.decode('utf-8', 'replace')}"
+    return "Unable to parse range" in detail
+
+def read_sheets_concurrently(spreadsheet_id: str, sheet_names: list) -> dict:
+    """
+    Read each sheet with its own values.get, all in parallel. A missing tab
+    comes back as an empty DataFrame instead of failing the other reads.
+    """
+    with ThreadPoolExecutor(max_workers=len(sheet_names)) as ex:
+        futures = {name: ex.submit(read_sheet_to_df, spreadsheet_id, name) for name in sheet_names}
+    sheets = {}
+    for name, fut in futures.items():
+        try:
+            sheets[name] = fut.result()
+        except RuntimeError as e:
+            if not _is_bad_range(e):
+                raise
+            sheets[name] = pd.DataFrame()
+    return sheets
+
+def fetch_xlsx_bytes(spreadsheet_id: str, creds) -> bytes:
+    """Download the whole spreadsheet as XLSX in one request via the export URL."""
+    if not creds.valid:
+        creds.refresh(google.auth.transport.requests.Request(session=SESSION))
+    export = f"https://docs.google.com/spreadsheets/d/{spreadsheet_id}/export?format=xlsx"
+    resp = SESSION.get(export, headers={"Authorization": f"Bearer {creds.token}"}, timeout=30)
+    resp.raise_for_status()
+    # an unauthorised export can come back as an HTML sign-in page with 200
+    if not resp.content.startswith(b"PK"):
+        raise requests.RequestException(f"Export of {spreadsheet_id} did not return an XLSX file")
+    return resp.content
 
-def download_and_process_spreadsheet(spreadsheet_id: str) -> str:
+def download_and_process_spreadsheet(spreadsheet_id: str) -> io.BytesIO:
     """
-    Reads 'Client Details' and 'Premiums' sheets, writes a combined XLSX, calls
-    make_term_quote_from_excel(), and returns path to generated DOCX.
+    Exports the spreadsheet as XLSX, calls make_term_quote() on its sheets, and
+    returns the generated DOCX in memory. Falls back to reading the sheets through
+    the Sheets API if the export fails.
     """
-    client_df = read_sheet_to_df(spreadsheet_id, "Client Details")
-    prem_df   = read_sheet_to_df(spreadsheet_id, "Premiums")
+    try:
+        content = fetch_xlsx_bytes(spreadsheet_id, get_service_account_creds())
+    except requests.RequestException:
+        sheets = _read_sheets_via_api(spreadsheet_id)
+    else:
+        sheets = read_sheets(io.BytesIO(content))
+        del content
+        _check_quote_sheets(sheets)
+        for name, df in sheets.items():
+            sheets[name] = _format_datetime_cells(df)
+
+    return make_term_quote(sheets)
 
+def _check_quote_sheets(sheets: dict):
+    """A quote needs at least one of 'Client Details' / 'Premiums' with data."""
+    client_df = sheets.get("Client Details", pd.DataFrame())
+    prem_df   = sheets.get("Premiums", pd.DataFrame())
     if client_df.empty and prem_df.empty:
         raise RuntimeError("Both 'Client Details' and 'Premiums' are empty or missing.")
 
-    tmpdir = tempfile.gettempdir()
-    combined_path = os.path.join(tmpdir, f"combined_{spreadsheet_id}.xlsx")
-    with pd.ExcelWriter(combined_path, engine="openpyxl") as writer:
-        if not client_df.empty:
-            client_df.to_excel(writer, sheet_name="Client Details", index=False)
-        else:
-            pd.DataFrame().to_excel(writer, sheet_name="Client Details", index=False)
-        if not prem_df.empty:
-            prem_df.to_excel(writer, sheet_name="Premiums", index=False)
-        else:
-            pd.DataFrame().to_excel(writer, sheet_name="Premiums", index=False)
-
-    output_path = make_term_quote_from_excel(combined_path)
-    return output_path
+def _format_cell(value):
+    if isinstance(value, (datetime, date)) and not pd.isna(value):
+        if isinstance(value, datetime) and value.time() != dt_time():
+            return value.strftime("%d-%m-%Y %H:%M")
+        return value.strftime("%d-%m-%Y")
+    return value
+
+def _format_datetime_cells(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Render date/datetime cells of an exported workbook as text, the way the
+    Sheets API path gets them, instead of '1990-01-02 00:00:00'.
+    Columns are addressed by position since headers may repeat.
+    """
+    df = df.copy()
+    for i in range(df.shape[1]):
+        col = df.iloc[:, i]
+        if pd.api.types.is_datetime64_any_dtype(col) or col.dtype == object:
+            df.isetitem(i, col.map(_format_cell).astype(object))
+    return df
+
+def _read_sheets_via_api(spreadsheet_id: str) -> dict:
+    """Read 'Client Details' and 'Premiums' with the Sheets API."""
+    names = ["Client Details", "Premiums"]
+    try:
+        sheets = read_sheets_batch(spreadsheet_id, names)
+    except RuntimeError as e:
+        # batchGet rejects the whole call when any one tab is missing
+        if not _is_bad_range(e):
+            raise
+        sheets = read_sheets_concurrently(spreadsheet_id, names)
+    _check_quote_sheets(sheets)
+    return sheets
 
 # ---------- Upload / web UI routes ----------
 @app.route("/", methods=["GET", "POST"])
@@ -101,36 +358,77 @@ def index():
 
         # Single combined file
         if single_file and (not client_file and not premium_file):
-            path = os.path.join(UPLOAD_FOLDER, "uploaded_combined.xlsx")
-            single_file.save(path)
-            try:
-                out = make_term_quote_from_excel(path)
-            except Exception as e:
-                return f"Error generating quote: {e}\n\n{traceback.format_exc()}", 500
-            return send_file(out, as_attachment=True)
+            with tempfile.TemporaryDirectory() as td:
+                path = os.path.join(td, "uploaded_combined.xlsx")
+                single_file.save(path)
+                try:
+                    out = make_term_quote(read_sheets(path))
+                except Exception as e:
+                    return f"Error generating quote: {e}\n\n{traceback.format_exc()}", 500
+            return send_docx(out, "uploaded_combined_term_quote_final.docx")
 
         # Two separate files
         if client_file and premium_file:
-            client_path = os.path.join(UPLOAD_FOLDER, "client.xlsx")
-            premium_path = os.path.join(UPLOAD_FOLDER, "premium.xlsx")
-            client_file.save(client_path)
-            premium_file.save(premium_path)
-            combined_path = os.path.join(UPLOAD_FOLDER, "combined_input.xlsx")
-            try:
-                with pd.ExcelWriter(combined_path, engine="openpyxl") as writer:
-                    pd.read_excel(client_path).to_excel(writer, sheet_name="Client Details", index=False)
-                    pd.read_excel(premium_path).to_excel(writer, sheet_name="Premiums", index=False)
-                out = make_term_quote_from_excel(combined_path)
-            except Exception as e:
-                return f"Error combining files: {e}\n\n{traceback.format_exc()}", 500
-            return send_file(out, as_attachment=True)
+            with tempfile.TemporaryDirectory() as td:
+                client_path = os.path.join(td, "client.xlsx")
+                premium_path = os.path.join(td, "premium.xlsx")
+                client_file.save(client_path)
+                premium_file.save(premium_path)
+                try:
+                    sheets = {
+                        "Client Details": pd.read_excel(client_path, engine="calamine"),
+                        "Premiums": pd.read_excel(premium_path, engine="calamine"),
+                    }
+                    out = make_term_quote(sheets)
+                except Exception as e:
+                    return f"Error combining files: {e}\n\n{traceback.format_exc()}", 500
+            return send_docx(out, "combined_input_term_quote_final.docx")
 
         return "Please upload either a combined Excel (file) or both client_file and premium_file.", 400
 
     # GET -> show template
     return render_template("index.html")
 
+@app.route("/upload_stream", methods=["POST"])
+def upload_stream():
+    """
+    Accept a raw XLSX request body (Content-Type: application/octet-stream) and
+    stream it to disk in 1 MiB chunks, bypassing the multipart parser.
+    Query string: ?kind=combined (the only supported kind for now).
+    """
+    if request.mimetype != "application/octet-stream":
+        return {"error": "Content-Type must be application/octet-stream"}, 415
+    if request.args.get("kind") != "combined":
+        return {"error": "unsupported kind, expected ?kind=combined"}, 400
+
+    with tempfile.TemporaryDirectory() as td:
+        path = os.path.join(td, "uploaded_combined.xlsx")
+        with open(path, "wb") as fp:
+            shutil.copyfileobj(request.stream, fp, length=UPLOAD_CHUNK_SIZE)
+        try:
+            out = make_term_quote(read_sheets(path))
+        except Exception as e:
+            return {"error": str(e), "trace": traceback.format_exc()}, 500
+    return send_docx(out, "uploaded_combined_term_quote_final.docx")
+
 # ---------- Sheets API endpoint ----------
+# spreadsheet_id -> (docx bytes, generated at); absorbs bursts of repeat calls.
+# Per process: each gunicorn worker keeps its own cache.
+_QUOTE_CACHE = TTLCache(maxsize=128, ttl=30)
+_QUOTE_CACHE_LOCK = threading.Lock()
+
+def get_cached_quote(spreadsheet_id: str):
+    """Return (docx bytes, generated_at) for the sheet, regenerating on a cache miss."""
+    with _QUOTE_CACHE_LOCK:
+        hit = _QUOTE_CACHE.get(spreadsheet_id)
+    if hit is not None:
+        return hit
+    out = download_and_process_spreadsheet(spreadsheet_id)
+    entry = (out.getvalue(), datetime.now(timezone.utc))
+    with _QUOTE_CACHE_LOCK:
+        _QUOTE_CACHE[spreadsheet_id] = entry
+    return entry
+
 @app.route("/process_by_sheetid", methods=["POST"])
 def process_by_sheetid():
     """
@@ -151,11 +449,12 @@ def process_by_sheetid():
         return {"error": "missing spreadsheet_id"}, 400
 
     try:
-        out = download_and_process_spreadsheet(sheet_id)
+        docx_bytes, generated_at = get_cached_quote(sheet_id)
     except Exception as e:
         return {"error": str(e), "trace": traceback.format_exc()}, 500
 
-    return send_file(out, as_attachment=True)
+    return send_docx(io.BytesIO(docx_bytes), f"{sheet_id}_term_quote_final.docx",
+                     last_modified=generated_at)
 
 # ---------- Utility route for local quick-test (uses uploaded sample) ----------
 @app.route("/local_test", methods=["GET"])
@@ -169,10 +468,10 @@ def local_test():
     if not os.path.exists(sample_path):
         return {"error": f"Sample not found at {sample_path}"}, 404
     try:
-        out = make_term_quote_from_excel(sample_path)
+        out = make_term_quote(read_sheets(sample_path))
     except Exception as e:
         return {"error": str(e), "trace": traceback.format_exc()}, 500
-    return send_file(out, as_attachment=True)
+    return send_docx(out, "Term_Quote_Input_Template_Dual_Pay_term_quote_final.docx")
 
 # ---------- Run ----------
 if __name__ == "__main__":
@@ -0,0 +1,16 @@
+# gunicorn.conf.py
+# Production server config: gunicorn -c gunicorn.conf.py app:app
+# The work is mostly waiting on Google (export / Sheets API), so threaded
+# workers give concurrency cheaply.
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+timeout = 120
+
+# recycle workers periodically so any slow memory growth is bounded
+max_requests = 500
+max_requests_jitter = 50
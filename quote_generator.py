@@ -1,35 +1,76 @@
 import pandas as pd
 from docx import Document
-from docx.shared import Pt, Inches
+from docx.shared import Length, Pt, Inches
 from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.oxml import OxmlElement
-from docx.oxml.ns import qn
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+from docx.table import Table
+from copy import deepcopy
+from xml.sax.saxutils import escape
+import io
 import os
 import datetime
+import tempfile
 import re
 
 def read_sheets(path):
-    xls = pd.ExcelFile(path)
-    sheets = {name: xls.parse(name) for name in xls.sheet_names}
+    # calamine parses the whole workbook in one pass, far lighter than openpyxl
+    sheets = pd.read_excel(path, sheet_name=None, engine="calamine")
     return sheets
 
 def set_cell_border(cell, **kwargs):
     # helper omitted for brevity (python-docx table border helper).
     pass
 
+# single black 4/8pt lines on every edge; parsed once, deep-copied per table
+_TBL_BORDERS = parse_xml(
+    f"<w:tblBorders {nsdecls('w')}>"
+    + "".join(f'<w:{name} w:val="single" w:sz="4" w:space="0" w:color="000000"/>'
+              for name in ('top', 'left', 'bottom', 'right', 'insideH', 'insideV'))
+    + "</w:tblBorders>"
+)
+
 def _add_table_borders(table):
-    # apply borders to the table
-    tbl = table._tbl
-    tblPr = tbl.get_or_add_tblPr()
-    tblBorders = OxmlElement('w:tblBorders')
-    for border_name in ('top','left','bottom','right','insideH','insideV'):
-        border = OxmlElement(f'w:{border_name}')
-        border.set(qn('w:val'), 'single')
-        border.set(qn('w:sz'), '4')  # width
-        border.set(qn('w:space'), '0')
-        border.set(qn('w:color'), '000000')
-        tblBorders.append(border)
-    tblPr.append(tblBorders)
+    # apply borders to the table (w:tblPr is a required child of w:tbl)
+    table._tbl.tblPr.append(deepcopy(_TBL_BORDERS))
+
+def _run_xml(text):
+    # same markup as python-docx's cell.text setter: \t -> <w:tab/>, \n and \r -> <w:br/>
+    if not text:
+        return ""
+    parts = []
+    for piece in re.split(r"([\t\n\r])", text):
+        if piece == "\t":
+            parts.append("<w:tab/>")
+        elif piece in ("\n", "\r"):
+            parts.append("<w:br/>")
+        elif piece:
+            parts.append(f'<w:t xml:space="preserve">{escape(piece)}</w:t>')
+    return f"<w:r>{''.join(parts)}</w:r>"
+
+def _add_table(document, rows):
+    """
+    Append a table whose first row is the header, built as one <w:tbl> XML
+    string and parsed once instead of growing it with add_row()/cell.text.
+    Mirrors the markup of document.add_table() (auto width, equal columns).
+    """
+    cols = len(rows[0])
+    col_twips = Length(document._block_width // cols).twips
+    tc_pr = f'<w:tcPr><w:tcW w:type="dxa" w:w="{col_twips}"/></w:tcPr>'
+    grid = f'<w:gridCol w:w="{col_twips}"/>' * cols
+    body = "".join(
+        "<w:tr>" + "".join(f"<w:tc>{tc_pr}<w:p>{_run_xml(text)}</w:p></w:tc>" for text in row) + "</w:tr>"
+        for row in rows
+    )
+    tbl = parse_xml(
+        f"<w:tbl {nsdecls('w')}>"
+        '<w:tblPr><w:tblW w:type="auto" w:w="0"/>'
+        '<w:tblLook w:firstColumn="1" w:firstRow="1" w:lastColumn="0" w:lastRow="0" '
+        'w:noHBand="0" w:noVBand="1" w:val="04A0"/></w:tblPr>'
+        f"<w:tblGrid>{grid}</w:tblGrid>{body}</w:tbl>"
+    )
+    document.element.body._insert_tbl(tbl)
+    return Table(tbl, document._body)
 
 def write_header(document, title_text, client_name):
     p = document.add_paragraph()
@@ -48,49 +89,37 @@ def write_header(document, title_text, client_name):
 
 def add_client_details_table(document, client_df):
     document.add_heading("Client Details", level=3)
-    table = document.add_table(rows=1, cols=2)
-    hdr_cells = table.rows[0].cells
-    hdr_cells[0].text = "Field"
-    hdr_cells[1].text = "Value"
-    for col in client_df.columns:
-        val = str(client_df.iloc[0].get(col, ""))
-        row = table.add_row().cells
-        row[0].text = col
-        row[1].text = val
+    first = client_df.iloc[0]
+    rows = [("Field", "Value")]
+    rows += [(str(col), str(first.get(col, ""))) for col in client_df.columns]
+    table = _add_table(document, rows)
     _add_table_borders(table)
 
 def add_cover_details_table(document, cover_info):
     document.add_heading("Cover Details", level=3)
-    table = document.add_table(rows=1, cols=4)
-    hdr = table.rows[0].cells
-    hdr[0].text = "Sum Assured"
-    hdr[1].text = "Policy Term"
-    hdr[2].text = "Cover Till Age"
-    hdr[3].text = "PPT"
-    # single row fill
-    r = table.add_row().cells
-    r[0].text = str(cover_info.get("Sum Assured", ""))
-    r[1].text = str(cover_info.get("Policy Term", ""))
-    r[2].text = str(cover_info.get("Cover Till Age", ""))
-    r[3].text = str(cover_info.get("PPT", ""))
+    keys = ["Sum Assured", "Policy Term", "Cover Till Age", "PPT"]
+    # header + single row fill
+    rows = [keys, [str(cover_info.get(k, "")) for k in keys]]
+    table = _add_table(document, rows)
     _add_table_borders(table)
 
+PREMIUM_COLUMNS = ["Insurance Company", "Plan Name", "Regular Premium", "10 Pay Premium", "Special Notes"]
+
 def add_premium_comparison(document, premiums_df):
     document.add_heading("Premium Comparison (Regular/10 Pay)", level=3)
     # wide first column for logos as placeholder
-    cols = [" ", "Company", "Plan", "Regular Premium", "10 Pay Premium", "Notes"]
-    table = document.add_table(rows=1, cols=len(cols))
-    hdr_cells = table.rows[0].cells
-    for i, name in enumerate(cols):
-        hdr_cells[i].text = name
-    for _, row in premiums_df.iterrows():
-        r = table.add_row().cells
-        r[0].text = ""  # logo placeholder (wide col)
-        r[1].text = str(row.get("Insurance Company", ""))
-        r[2].text = str(row.get("Plan Name", ""))
-        r[3].text = str(row.get("Regular Premium", ""))
-        r[4].text = str(row.get("10 Pay Premium", row.get("10 Pay", "")))
-        r[5].text = str(row.get("Special Notes", ""))
+    rows = [[" ", "Company", "Plan", "Regular Premium", "10 Pay Premium", "Notes"]]
+    if "10 Pay Premium" not in premiums_df.columns and "10 Pay" in premiums_df.columns:
+        premiums_df = premiums_df.rename(columns={"10 Pay": "10 Pay Premium"})
+    # repeated/blank headers are common in Sheets data; reindex needs unique labels
+    # (first occurrence wins, as row.get() did)
+    premiums_df = premiums_df.loc[:, ~premiums_df.columns.duplicated()]
+    # stringify once up front; missing columns become empty cells
+    df = premiums_df.reindex(columns=PREMIUM_COLUMNS, fill_value="")
+    df = df.where(df.notna(), "").astype(str)
+    # first cell of each row is the logo placeholder (wide col), left empty
+    rows += [("",) + row for row in df.itertuples(index=False, name=None)]
+    table = _add_table(document, rows)
     _add_table_borders(table)
 
 def add_advisory_note(document, notes_text):
@@ -99,12 +128,24 @@ def add_advisory_note(document, notes_text):
     p.add_run(notes_text)
 
 def make_term_quote_from_excel(excel_path):
-    # Read sheets
-    sheets = read_sheets(excel_path)
-    # Default sheet handling
-    client_df = sheets.get("Client Details", None)
-    premiums_df = sheets.get("Premiums", None)
-    final_notes_df = sheets.get("Final Notes", None)
+    # CLI shim: writes <stem>_term_quote_final.docx to the temp dir, returns its path
+    buf = make_term_quote(read_sheets(excel_path))
+    out_fname = os.path.splitext(os.path.basename(excel_path))[0] + "_term_quote_final.docx"
+    out_path = os.path.join(tempfile.gettempdir(), out_fname)
+    with open(out_path, "wb") as f:
+        f.write(buf.getvalue())
+    return out_path
+
+def make_term_quote(sheets):
+    """
+    Build the quote DOCX from a {sheet_name: DataFrame} dict and return it as
+    an in-memory BytesIO positioned at the start. The sheets dict is consumed.
+    """
+    # Default sheet handling. Entries are popped so each DataFrame can be
+    # freed as soon as its section has been written.
+    client_df = sheets.pop("Client Details", None)
+    premiums_df = sheets.pop("Premiums", None)
+    final_notes_df = sheets.pop("Final Notes", None)
 
     # Create document
     doc = Document()
@@ -126,6 +167,7 @@ def make_term_quote_from_excel(excel_path):
         for key in ["Sum Assured", "Policy Term", "Cover Till Age", "PPT"]:
             if key in client_df.columns:
                 cover_info[key] = client_df.loc[0, key]
+    client_df = None
     add_cover_details_table(doc, cover_info)
 
     # Premiums
@@ -133,14 +175,17 @@ def make_term_quote_from_excel(excel_path):
         # Normalize column names if needed
         # Expect columns: Insurance Company, Plan Name, Regular Premium, 10 Pay Premium, Special Notes
         add_premium_comparison(doc, premiums_df)
+    premiums_df = None
 
     # Advisory
     notes_text = ""
     if final_notes_df is not None and not final_notes_df.empty:
         # combine all text cells
-        notes_text = " ".join(map(str, final_notes_df.fillna("").astype(str).apply(lambda row: " ".join(row), axis=1).tolist()))
+        # row-major ravel gives the same order as joining row by row
+        notes_text = " ".join(final_notes_df.fillna("").astype(str).to_numpy().ravel().tolist())
     else:
         notes_text = "Recommendation: 10 Pay offers quicker benefit accumulation — consider max allowed cover and fixed premiums for life. Contact your advisor for exact tailored recommendation. ⚠️ This is a system-generated quote."
+    final_notes_df = None
     add_advisory_note(doc, notes_text)
 
     # Contact section
@@ -148,12 +193,16 @@ def make_term_quote_from_excel(excel_path):
     p = doc.add_paragraph()
     p.add_run("Agent Name: __________________\nMobile: __________________\n")
 
-    # Save file
-    out_fname = os.path.splitext(os.path.basename(excel_path))[0] + "_term_quote_final.docx"
-    out_path = os.path.join("/tmp", out_fname)
-    doc.save(out_path)
-    return out_path
+    # Save to memory; callers stream it straight into the response
+    buf = io.BytesIO()
+    doc.save(buf)
+    buf.seek(0)
+    return buf
 
 if __name__ == "__main__":
-    # quick local test placeholder
-    print("Module loaded")
+    # quick local test: python quote_generator.py <input.xlsx>
+    import sys
+    if len(sys.argv) > 1:
+        print(make_term_quote_from_excel(sys.argv[1]))
+    else:
+        print("Module loaded")
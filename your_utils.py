@@ -1,14 +1,22 @@
 # your_utils.py
 import re, requests
+from requests.adapters import HTTPAdapter
+
+_SHEET_ID_RE = re.compile(r"/d/([A-Za-z0-9_-]+)/")
+
+# pooled keep-alive session, reused across downloads
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10))
 
 def download_sheet_as_xlsx(sheet_url: str, out_path: str):
-    m = re.search(r"/d/([A-Za-z0-9_-]+)/", sheet_url)
+    m = _SHEET_ID_RE.search(sheet_url)
     if not m:
         raise ValueError("Invalid Google Sheet URL.")
     fid = m.group(1)
     export = f"https://docs.google.com/spreadsheets/d/{fid}/export?format=xlsx"
-    r = requests.get(export)
-    r.raise_for_status()
-    with open(out_path, "wb") as f:
-        f.write(r.content)
+    with _SESSION.get(export, stream=True, timeout=30) as r:
+        r.raise_for_status()
+        with open(out_path, "wb") as f:
+            for chunk in r.iter_content(1 << 20):
+                f.write(chunk)
     return out_path